@@ -0,0 +1,134 @@
+"""Benchmarks of the memmap based collection and session loading"""
+
+import os
+from datetime import datetime
+from datetime import timedelta
+
+import numpy as np
+
+from thinkgear.collect import BUFFER_SIZE
+from thinkgear.collect import DataCollector
+from thinkgear.collect import SAMPLING_FREQUENCY
+from thinkgear.collect import TIMESTAMP_PERIOD
+from thinkgear.thinkgear import ThinkGearRawWaveData
+from thinkgear.emulator import encode_raw_wave
+
+from .common import StreamProtocol
+from .common import TemporaryFolderMixin
+from .common import ThroughputBenchmark
+from .common import make_stream
+
+
+class DecodedProtocol(object):
+    """Replay already decoded packets to only measure the collector"""
+
+    def __init__(self, packets):
+        self.packets = packets
+
+    def get_packets(self):
+        return iter(self.packets)
+
+
+class Collect(TemporaryFolderMixin, ThroughputBenchmark):
+    """DataCollector.collect of 10s of data, including chunk rotations
+
+    The 'stream' protocol parses a synthetic byte stream while 'decoded'
+    replays decoded packets to measure the buffer writes alone.
+    """
+
+    params = (['stream', 'decoded'], [SAMPLING_FREQUENCY, BUFFER_SIZE])
+    param_names = ['protocol', 'chunk_size']
+
+    def setup(self, protocol, chunk_size):
+        self.make_folder()
+        self.n_samples = SAMPLING_FREQUENCY * 10
+        # data, quality and timestamps buffers
+        self.n_bytes = (self.n_samples * (np.dtype(np.double).itemsize
+                                          + np.dtype(np.bool).itemsize)
+                        + self.n_samples // TIMESTAMP_PERIOD
+                        * np.dtype(np.double).itemsize)
+        if protocol == 'stream':
+            self.device, _ = make_stream(self.n_samples)
+            self.protocol = StreamProtocol
+        else:
+            self.device = [
+                [ThinkGearRawWaveData(0, 0x80, encode_raw_wave(i % 1000)[2:])]
+                for i in xrange(self.n_samples)]
+            self.protocol = DecodedProtocol
+
+    def run(self, protocol, chunk_size):
+        collector = DataCollector(self.device, self.data_folder,
+                                  chunk_size=chunk_size,
+                                  protocol=self.protocol)
+        collector.collect(self.n_samples)
+
+    def time_collect(self, protocol, chunk_size):
+        self.run(protocol, chunk_size)
+
+
+class TrimBuffer(TemporaryFolderMixin, ThroughputBenchmark):
+    """DataCollector.trim_buffer of a half filled buffer of 1 minute"""
+
+    # each buffer can only be trimmed once
+    number = 1
+    warmup_time = 0
+
+    def setup(self):
+        self.collector = DataCollector(None, self.make_folder())
+        self.session_id = self.collector.make_session()
+        self.n_samples = BUFFER_SIZE // 2
+        self.n_bytes = self.n_samples * np.dtype(self.collector.dtype).itemsize
+        self.prepare_run()
+
+    def prepare_run(self):
+        self.buffer = self.collector.make_buffer(self.session_id)
+
+    def run(self):
+        DataCollector.trim_buffer(self.buffer, self.n_samples)
+
+    def time_trim_buffer(self):
+        self.run()
+
+
+class GetSession(TemporaryFolderMixin, ThroughputBenchmark):
+    """DataCollector.get_session of single and many chunks sessions
+
+    The data is summed to include the paging in of the memmaped files.
+    """
+
+    params = [1, 1000]
+    param_names = ['n_chunks']
+
+    chunk_size = SAMPLING_FREQUENCY
+
+    def setup(self, n_chunks):
+        self.collector = DataCollector(None, self.make_folder(),
+                                       chunk_size=self.chunk_size)
+        self.session_id = self.collector.make_session()
+        signal_folder = os.path.join(self.data_folder, self.session_id,
+                                     'data')
+        os.makedirs(signal_folder)
+
+        # one timestamped chunk per minute as a long collect would write
+        rng = np.random.RandomState(42)
+        start = datetime(2011, 1, 1)
+        dtype = np.dtype(self.collector.dtype)
+        for i in range(n_chunks):
+            ts = (start + timedelta(minutes=i)).strftime("%Y-%m-%d_%H-%M-%S")
+            filename = '%s%s_000.%s.memmap' % (self.collector.prefix, ts,
+                                                dtype.name)
+            chunk = np.memmap(os.path.join(signal_folder, filename),
+                              dtype=dtype, mode='w+',
+                              shape=(self.chunk_size,))
+            chunk[:] = rng.normal(size=self.chunk_size)
+            chunk.flush()
+            del chunk
+
+        self.n_samples = n_chunks * self.chunk_size
+        self.n_bytes = self.n_samples * dtype.itemsize
+
+    def run(self, n_chunks):
+        self.collector.get_session(self.session_id).sum()
+
+    def time_get_session(self, n_chunks):
+        self.run(n_chunks)
@@ -0,0 +1,61 @@
+"""Benchmarks of the ThinkGear packet framing and decoding"""
+
+from itertools import islice
+
+from thinkgear.collect import SAMPLING_FREQUENCY
+from thinkgear.emulator import encode_raw_wave
+from thinkgear.emulator import encode_eeg_power
+from thinkgear.emulator import encode_attention
+from thinkgear.emulator import encode_poor_signal
+
+from .common import StreamProtocol
+from .common import ThroughputBenchmark
+from .common import make_stream
+
+
+class GetPackets(ThroughputBenchmark):
+    """Sync, checksum and decode of a stream of 10s of data"""
+
+    def setup(self):
+        self.n_samples = SAMPLING_FREQUENCY * 10
+        self.stream, self.n_packets = make_stream(self.n_samples)
+        self.n_bytes = len(self.stream)
+
+    def run(self):
+        # the stream is finite while get_packets is not
+        protocol = StreamProtocol(self.stream)
+        for _ in islice(protocol.get_packets(), self.n_packets):
+            pass
+
+    def time_get_packets(self):
+        self.run()
+
+
+class Decode(ThroughputBenchmark):
+    """ThinkGearProtocol._decode of single data rows per code"""
+
+    params = ['raw', 'eeg_power', 'attention', 'poor_signal']
+    param_names = ['code']
+
+    payloads = {
+        'raw': encode_raw_wave(-1234),
+        'eeg_power': encode_eeg_power([1, 12, 123, 1234, 12345, 123456,
+                                       1234567, 12345678]),
+        'attention': encode_attention(42),
+        'poor_signal': encode_poor_signal(0),
+    }
+
+    def setup(self, code):
+        self.protocol = StreamProtocol('')
+        self.payload = self.payloads[code]
+        self.n_samples = 10000
+        self.n_bytes = self.n_samples * len(self.payload)
+
+    def run(self, code):
+        decode = self.protocol._decode
+        payload = self.payload
+        for _ in xrange(self.n_samples):
+            decode(payload)
+
+    def time_decode(self, code):
+        self.run(code)
@@ -0,0 +1,79 @@
+"""Synthetic ThinkGear streams and helpers shared by the benchmarks"""
+
+import time
+import tempfile
+import shutil
+from cStringIO import StringIO
+
+from thinkgear.collect import SAMPLING_FREQUENCY
+from thinkgear.emulator import ThinkGearEmulator
+from thinkgear.thinkgear import ThinkGearProtocol
+
+
+def make_stream(n_samples, **emulator_params):
+    """Bytes of n_samples raw wave packets as sent by a MindSet
+
+    The stream includes the once per second EEG power, attention, meditation
+    and poor signal packet. Returns (stream, n_packets).
+    """
+    emulator = ThinkGearEmulator(block_size=SAMPLING_FREQUENCY,
+                                 **emulator_params)
+    try:
+        blocks = []
+        while emulator.emitted < n_samples:
+            blocks.append(emulator.make_block())
+            emulator.emitted += emulator.block_size
+    finally:
+        emulator.stop()
+    n_blocks = len(blocks)
+    # one extra packet per block of one second
+    return ''.join(blocks), n_blocks * (SAMPLING_FREQUENCY + 1)
+
+
+class StreamProtocol(ThinkGearProtocol):
+    """Parse an in-memory byte stream instead of a serial device"""
+
+    def __init__(self, stream):
+        self.serial = StringIO(stream)
+        self.preread = StringIO()
+        self.io = self.serial
+
+
+class TemporaryFolderMixin(object):
+
+    def make_folder(self):
+        self.data_folder = tempfile.mkdtemp(prefix='pythinkgear_bench_')
+        return self.data_folder
+
+    def teardown(self, *params):
+        shutil.rmtree(self.data_folder)
+
+
+class ThroughputBenchmark(object):
+    """Report samples/s and MB/s of the run method as asv tracked values
+
+    Subclasses set n_samples and n_bytes in setup. The best of n_runs runs
+    is reported, preceded by a call to prepare_run if any.
+    """
+
+    n_runs = 5
+
+    def prepare_run(self, *params):
+        pass
+
+    def best_duration(self, *params):
+        durations = []
+        for _ in range(self.n_runs):
+            self.prepare_run(*params)
+            start = time.time()
+            self.run(*params)
+            durations.append(time.time() - start)
+        return min(durations)
+
+    def track_samples_per_second(self, *params):
+        return self.n_samples / self.best_duration(*params)
+    track_samples_per_second.unit = 'samples/s'
+
+    def track_megabytes_per_second(self, *params):
+        return self.n_bytes / 1e6 / self.best_duration(*params)
+    track_megabytes_per_second.unit = 'MB/s'
@@ -0,0 +1,172 @@
+"""Batch spectral feature extraction over recorded sessions"""
+
+import logging
+import traceback
+from multiprocessing import Pool
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+from .collect import DataCollector
+from .collect import SAMPLING_FREQUENCY
+from .thinkgear import EEGPowerData
+
+
+# Frequency ranges in Hz of the bands reported by the ThinkGear ASIC in the
+# EEGPowerData packets, in the same order as the namedtuple fields
+BANDS = EEGPowerData(
+    delta=(0.5, 2.75),
+    theta=(3.5, 6.75),
+    lowalpha=(7.5, 9.25),
+    highalpha=(10.0, 11.75),
+    lowbeta=(13.0, 16.75),
+    highbeta=(18.0, 29.75),
+    lowgamma=(31.0, 39.75),
+    midgamma=(41.0, 49.75),
+)
+
+
+def sliding_windows(data, window_size, step):
+    """Return a (n_windows, window_size) strided view on a 1D array
+
+    No data is copied: consecutive windows share memory whenever
+    step < window_size. Trailing samples that do not fill a complete window
+    are dropped.
+    """
+    data = np.asarray(data)
+    n_windows = max(0, (data.shape[0] - window_size) // step + 1)
+    stride = data.strides[0]
+    return as_strided(data, shape=(n_windows, window_size),
+                      strides=(stride * step, stride))
+
+
+def band_matrix(window_size, sampling_frequency=SAMPLING_FREQUENCY,
+                bands=BANDS):
+    """Indicator matrix mapping rfft frequency bins to bands
+
+    The result has shape (window_size // 2 + 1, len(bands)) so that the band
+    powers of a batch of spectra are obtained by a single dot product.
+    """
+    freqs = np.arange(window_size // 2 + 1) * (float(sampling_frequency)
+                                                / window_size)
+    matrix = np.zeros((freqs.shape[0], len(bands)))
+    for i, (low, high) in enumerate(bands):
+        matrix[:, i] = (freqs >= low) & (freqs <= high)
+    return matrix
+
+
+def band_powers(data, quality=None, window_size=SAMPLING_FREQUENCY,
+                step=None, sampling_frequency=SAMPLING_FREQUENCY,
+                min_quality=1.0):
+    """Compute the per-window EEG band powers of a raw signal
+
+    All the windows are processed as a single batched FFT. Returns a tuple
+    (powers, good) where powers has shape (n_windows, 8) with columns
+    ordered as the EEGPowerData fields, and good is a boolean mask of the
+    windows whose fraction of good quality samples is at least min_quality.
+    """
+    if step is None:
+        step = window_size
+    windows = sliding_windows(data, window_size, step)
+    n_windows = windows.shape[0]
+    if n_windows == 0:
+        return np.zeros((0, len(BANDS))), np.zeros(0, dtype=bool)
+
+    # center each window and taper it to limit the spectral leakage of the
+    # large DC offset of the raw signal
+    windows = windows - windows.mean(axis=1)[:, np.newaxis]
+    windows *= np.hanning(window_size)
+    spectra = np.abs(np.fft.rfft(windows, axis=1)) ** 2
+    powers = np.dot(spectra, band_matrix(window_size, sampling_frequency))
+
+    if quality is None:
+        good = np.ones(n_windows, dtype=bool)
+    else:
+        quality_windows = sliding_windows(quality, window_size, step)
+        good = quality_windows.mean(axis=1) >= min_quality
+    return powers, good
+
+
+def session_band_powers(data_folder, session_id, **params):
+    """Load a session from disk and compute its band powers
+
+    The memmaped data and quality signals are opened by the calling process
+    so that worker processes only exchange the session id and the results.
+    """
+    collector = DataCollector(None, data_folder)
+    data = collector.get_session(session_id, signal='data')
+    quality = collector.get_session(session_id, signal='quality')
+    if quality.shape != data.shape:
+        logging.warn("Ignoring quality signal of session %s: shape %r does"
+                     " not match data %r", session_id, quality.shape,
+                     data.shape)
+        quality = None
+    return band_powers(data, quality, **params)
+
+
+def session_summary(data_folder, session_id):
+    """Summary statistics of the raw signal and quality of a session"""
+    collector = DataCollector(None, data_folder)
+    data = collector.get_session(session_id, signal='data')
+    quality = collector.get_session(session_id, signal='quality')
+    return {
+        'n_samples': data.shape[0],
+        'mean': float(data.mean()) if data.shape[0] else np.nan,
+        'std': float(data.std()) if data.shape[0] else np.nan,
+        'quality_ratio': (float(quality.mean()) if quality.shape[0]
+                          else np.nan),
+    }
+
+
+def _session_band_powers_job(args):
+    data_folder, session_id, params = args
+    try:
+        return session_id, session_band_powers(data_folder, session_id,
+                                               **params), None
+    except Exception:
+        # exceptions are not always picklable: send the traceback instead
+        return session_id, None, traceback.format_exc()
+
+
+def batch_band_powers(data_folder, sessions=None, n_jobs=None, **params):
+    """Compute the band powers of many sessions in parallel
+
+    sessions is a list of session ids, all the recorded sessions of
+    data_folder by default. Each session is processed by a worker process
+    out of a pool of n_jobs (the number of CPUs by default). Extra
+    parameters are passed to band_powers.
+
+    A session that cannot be processed does not abort the others. Returns
+    a tuple (results, errors) of dicts mapping session ids to (powers, good)
+    tuples and to the traceback of the failed sessions respectively.
+    """
+    if sessions is None:
+        sessions = DataCollector(None, data_folder).list_sessions()
+    jobs = [(data_folder, session_id, params) for session_id in sessions]
+
+    pool = None
+    if n_jobs == 1:
+        outcomes = map(_session_band_powers_job, jobs)
+    else:
+        pool = Pool(n_jobs)
+        outcomes = pool.imap_unordered(_session_band_powers_job, jobs)
+
+    results, errors = {}, {}
+    try:
+        for session_id, result, error in outcomes:
+            if error is None:
+                results[session_id] = result
+            else:
+                logging.warn("Failed to process session %s:\n%s",
+                             session_id, error)
+                errors[session_id] = error
+    except:
+        # do not wait for the queued sessions, e.g. on KeyboardInterrupt
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        raise
+    if pool is not None:
+        pool.close()
+        pool.join()
+    return results, errors
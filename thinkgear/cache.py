@@ -0,0 +1,188 @@
+"""Persistent on-disk cache of results derived from recorded sessions"""
+
+import os
+import time
+import logging
+import hashlib
+import tempfile
+import cPickle as pickle
+
+import numpy as np
+
+
+# Default size budget of the cache folder: 256MB
+CACHE_SIZE = 256 * 1024 ** 2
+
+# Age in seconds after which a temporary file is considered left over by a
+# failed or interrupted write rather than being written concurrently
+TMP_FILE_AGE = 3600
+
+
+class SessionCache(object):
+    """Memoize results computed from sessions of a data folder on disk
+
+    Results are keyed by the session id, the manifest of the chunk files of
+    the session (names, sizes and modification times), the function and its
+    parameters: any new or updated chunk of a session hence invalidates the
+    previously cached results for that session.
+
+    The least recently used results are evicted to keep the total size of
+    the cache folder under max_size bytes.
+    """
+
+    def __init__(self, data_folder, cache_folder=None, max_size=CACHE_SIZE):
+        if cache_folder is None:
+            # hidden folders are ignored by DataCollector.list_sessions
+            cache_folder = os.path.join(data_folder, '.cache')
+        if not os.path.exists(cache_folder):
+            os.makedirs(cache_folder)
+        self.data_folder = data_folder
+        self.cache_folder = cache_folder
+        self.max_size = max_size
+
+    def get_manifest(self, session_id):
+        """Sorted list of (signal, filename, size, mtime) of a session
+
+        Files at the root of the session folder have an empty signal name.
+        """
+        session_folder = os.path.join(self.data_folder, session_id)
+        if not os.path.isdir(session_folder):
+            raise ValueError("No such session %r" % session_id)
+        manifest = []
+        for signal in sorted(os.listdir(session_folder)):
+            signal_folder = os.path.join(session_folder, signal)
+            if not os.path.isdir(signal_folder):
+                # session metadata file
+                st = os.stat(signal_folder)
+                manifest.append(('', signal, st.st_size, st.st_mtime))
+                continue
+            for filename in sorted(os.listdir(signal_folder)):
+                st = os.stat(os.path.join(signal_folder, filename))
+                manifest.append((signal, filename, st.st_size, st.st_mtime))
+        return manifest
+
+    @staticmethod
+    def get_function_name(func):
+        return "%s.%s" % (func.__module__, func.__name__)
+
+    @classmethod
+    def _digest(cls, value):
+        h = hashlib.sha1()
+        cls._hash_update(h, value)
+        return h.hexdigest()[:16]
+
+    @classmethod
+    def _hash_update(cls, h, value):
+        """Hash value by content: the repr of large arrays is truncated"""
+        if isinstance(value, np.ndarray) and value.dtype != object:
+            h.update('ndarray(%r, %r)' % (value.dtype.str, value.shape))
+            h.update(np.ascontiguousarray(value).tobytes())
+        elif isinstance(value, np.ndarray):
+            h.update('ndarray(object, %r)' % (value.shape,))
+            cls._hash_update(h, value.tolist())
+        elif isinstance(value, dict):
+            h.update('dict')
+            cls._hash_update(h, sorted(value.items()))
+        elif isinstance(value, (list, tuple)):
+            h.update('%s(%d)[' % (type(value).__name__, len(value)))
+            for item in value:
+                cls._hash_update(h, item)
+                h.update(',')
+            h.update(']')
+        else:
+            h.update(repr(value))
+
+    def get_key(self, func, session_id, params):
+        """Filename of the cached result of func for the session"""
+        return "%s_%s_%s_%s.pickle" % (
+            session_id, self.get_function_name(func),
+            self._digest(self.get_manifest(session_id)),
+            self._digest(sorted(params.items())))
+
+    def call(self, func, session_id, **params):
+        """Return func(data_folder, session_id, **params), memoized on disk"""
+        key = self.get_key(func, session_id, params)
+        filepath = os.path.join(self.cache_folder, key)
+        if os.path.exists(filepath):
+            try:
+                with open(filepath, 'rb') as f:
+                    result = pickle.load(f)
+                # touch the file to record its last use for LRU eviction
+                os.utime(filepath, None)
+                return result
+            except (IOError, OSError, EOFError, pickle.UnpicklingError):
+                # concurrently evicted or partially written entry
+                logging.info("Ignoring unreadable cache entry %s", filepath)
+
+        result = func(self.data_folder, session_id, **params)
+        self.discard_stale(key)
+        self.store(filepath, result)
+        self.evict()
+        return result
+
+    def store(self, filepath, result):
+        # write to a temporary file first and rename it so that concurrent
+        # readers never see a partially written entry
+        fd, tmp_filepath = tempfile.mkstemp(dir=self.cache_folder,
+                                            suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(result, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_filepath, filepath)
+        except:
+            self._remove(tmp_filepath)
+            raise
+
+    def discard_stale(self, key):
+        """Remove the results of func for older versions of the session"""
+        prefix, manifest_digest, _ = key.rsplit('_', 2)
+        prefix += '_'
+        for filename in os.listdir(self.cache_folder):
+            if (not filename.startswith(prefix)
+                or not filename.endswith('.pickle')):
+                continue
+            digests = filename[len(prefix):].split('_')
+            if len(digests) == 2 and digests[0] != manifest_digest:
+                self._remove(os.path.join(self.cache_folder, filename))
+
+    def evict(self):
+        """Remove least recently used entries until under max_size bytes
+
+        Temporary files left over by interrupted writes are removed as well.
+        """
+        entries = []
+        now = time.time()
+        for filename in os.listdir(self.cache_folder):
+            filepath = os.path.join(self.cache_folder, filename)
+            try:
+                st = os.stat(filepath)
+            except OSError:
+                continue
+            if filename.endswith('.tmp'):
+                if now - st.st_mtime > TMP_FILE_AGE:
+                    logging.info("Removing left over file %s", filepath)
+                    self._remove(filepath)
+                continue
+            if filename.endswith('.pickle'):
+                entries.append((st.st_mtime, st.st_size, filepath))
+        entries.sort()
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, filepath in entries:
+            if total_size <= self.max_size:
+                break
+            logging.info("Evicting cache entry %s", filepath)
+            self._remove(filepath)
+            total_size -= size
+
+    def clear(self):
+        for filename in os.listdir(self.cache_folder):
+            self._remove(os.path.join(self.cache_folder, filename))
+
+    @staticmethod
+    def _remove(filepath):
+        try:
+            os.unlink(filepath)
+        except OSError:
+            # already removed by a concurrent process
+            pass
@@ -27,14 +27,10 @@
 import logging
 import sys
 import os
+import time
+import json
 from datetime import datetime
 
-import gtk
-import gobject
-import matplotlib
-matplotlib.use('GTKAgg')
-import matplotlib.pyplot as plt
-
 import numpy as np
 
 from .thinkgear import ThinkGearProtocol
@@ -48,6 +44,66 @@ SAMPLING_FREQUENCY = 512
 # One file per 1 minute of collected data
 BUFFER_SIZE = SAMPLING_FREQUENCY * 60
 
+# Record the receive time of one sample out of 32
+TIMESTAMP_PERIOD = 32
+
+# Name of the file storing the collection parameters in a session folder
+METADATA_FILENAME = 'metadata.json'
+
+# Minimum duration in seconds of the dropped samples to report a gap
+MIN_GAP = 0.05
+
+# Duration in seconds over which the transmission jitter is removed: longer
+# than the bluetooth stalls but short enough to follow the clock drift of
+# the device
+JITTER_WINDOW = 5.0
+
+
+def posix_monotonic_clock():
+    """Return a clock_gettime(CLOCK_MONOTONIC) function, None if missing"""
+    clock_ids = {'linux': 1, 'freebsd': 4, 'darwin': 6}
+    clock_id = [v for k, v in clock_ids.items() if sys.platform.startswith(k)]
+    if not clock_id:
+        return None
+    clock_id = clock_id[0]
+
+    import ctypes
+    import ctypes.util
+
+    class timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    try:
+        # older glibc versions only provide clock_gettime in librt
+        libc = ctypes.CDLL(ctypes.util.find_library('rt'), use_errno=True)
+        clock_gettime = libc.clock_gettime
+    except (OSError, AttributeError):
+        return None
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+
+    def monotonic():
+        t = timespec()
+        if clock_gettime(clock_id, ctypes.byref(t)) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        return t.tv_sec + t.tv_nsec * 1e-9
+
+    try:
+        monotonic()
+    except OSError:
+        return None
+    return monotonic
+
+
+try:
+    from time import monotonic as clock
+except ImportError:
+    clock = posix_monotonic_clock()
+    if clock is None:
+        logging.warn("No monotonic clock available: sample timestamps will"
+                     " follow the adjustments of the wall clock")
+        clock = time.time
+
 
 class DataCollector(object):
     """Read data from the device and serialize it on disk
@@ -59,7 +115,7 @@ class DataCollector(object):
     def __init__(self, device, data_folder, prefix='pythinkgear_',
                  chunk_size=BUFFER_SIZE, dtype=np.double,
                  protocol=ThinkGearProtocol, packet_type=ThinkGearRawWaveData,
-                 monitor=None):
+                 monitor=None, timestamp_period=TIMESTAMP_PERIOD):
         if not os.path.exists(data_folder):
             os.makedirs(data_folder)
         self.data_folder = data_folder
@@ -70,6 +126,7 @@ class DataCollector(object):
         self.protocol = protocol
         self.packet_type = packet_type
         self.monitor = monitor
+        self.timestamp_period = timestamp_period
         if monitor is not None:
             monitor.init(self)
 
@@ -77,12 +134,13 @@ class DataCollector(object):
         """Up to the second, filename same timestamp"""
         return datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
 
-    def make_buffer(self, session_id, signal='data', dtype=None):
+    def make_buffer(self, session_id, signal='data', dtype=None, size=None):
         signal_folder = os.path.join(self.data_folder, session_id, signal)
         if not os.path.exists(signal_folder):
             os.makedirs(signal_folder)
         dtype = dtype if dtype is not None else self.dtype
         dtype = np.dtype(dtype)
+        size = size if size is not None else self.chunk_size
 
         # build a non existing filename based on a timestamp and a integer
         # increment
@@ -99,7 +157,7 @@ class DataCollector(object):
 
         logging.info("Creating new buffer: %s", filepath)
         buffer = np.memmap(filepath, dtype=dtype, mode='w+',
-                           shape=(self.chunk_size,))
+                           shape=(size,))
         # set all the buffer values to zero to be able to detect partially
         # filled buffers
         buffer[:] = 0.0
@@ -136,7 +194,8 @@ class DataCollector(object):
         if cursor >= buffer.shape[0]:
             buffer.flush()
             buffer = self.make_buffer(session_id, signal=signal,
-                                      dtype=buffer.dtype)
+                                      dtype=buffer.dtype,
+                                      size=buffer.shape[0])
             cursor = 0
         return cursor, buffer
 
@@ -156,14 +215,24 @@ class DataCollector(object):
         """Collect samples from the device using the protocol instance
 
         Instance are buffered in memory mapped arrays of fixed size.
+
+        The receive time of one sample out of timestamp_period is stored in
+        the 'timestamps' signal, see get_timestamps.
         """
         session_id = self.make_session()
+        self.save_metadata(session_id, timestamp_period=self.timestamp_period)
         collected = 0
         logging.info("Opening connection to %s", self.device)
         cursor = 0
         data_buffer = self.make_buffer(session_id, signal='data')
         quality_buffer = self.make_buffer(session_id, signal='quality',
                                           dtype=np.bool)
+        ts_cursor = 0
+        ts_buffer = self.make_buffer(
+            session_id, signal='timestamps', dtype=np.double,
+            size=max(1, self.chunk_size // self.timestamp_period))
+        # monotonic receive times anchored on the wall clock
+        wall_start, clock_start = time.time(), clock()
         quality = True  # assume good data by default
         try:
             for pkt in self.protocol(self.device).get_packets():
@@ -191,6 +260,13 @@ class DataCollector(object):
                             signal='quality')
                         cursor, data_buffer = self.check_buffer(
                             cursor, data_buffer, session_id, signal='data')
+                        if collected % self.timestamp_period == 0:
+                            ts_cursor, ts_buffer = self.check_buffer(
+                                ts_cursor, ts_buffer, session_id,
+                                signal='timestamps')
+                            ts_buffer[ts_cursor] = (wall_start + clock()
+                                                    - clock_start)
+                            ts_cursor += 1
                         data_buffer[cursor] = d.value
                         quality_buffer[cursor] = quality
                         cursor += 1
@@ -201,6 +277,7 @@ class DataCollector(object):
                             # the data in almost real time
                             data_buffer.flush()
                             quality_buffer.flush()
+                            ts_buffer.flush()
                             self.monitor.update(
                                 data_buffer[cursor - self.monitor.period:cursor])
                         if n_samples is not None and collected >= n_samples:
@@ -211,13 +288,20 @@ class DataCollector(object):
             if cursor > 0:
                 self.trim_buffer(data_buffer, cursor)
                 self.trim_buffer(quality_buffer, cursor)
+            if ts_cursor > 0:
+                ts_buffer.flush()
+                self.trim_buffer(ts_buffer, ts_cursor)
+            self.record_gaps(session_id)
             logging.info('Closing connection to %s', self.device)
 
         return session_id
 
     def list_sessions(self):
         """Return the list of recorded session ids, sorted by date"""
-        sessions = os.listdir(self.data_folder)
+        # hidden folders such as the cache of derived results are not
+        # sessions
+        sessions = [s for s in os.listdir(self.data_folder)
+                    if not s.startswith('.')]
         sessions.sort()
         return sessions
 
@@ -236,6 +320,38 @@ class DataCollector(object):
         _, dtype_string = filename.rsplit('.', 1)
         return np.dtype(dtype_string)
 
+    def get_session_id(self, session=-1):
+        """Return the id of a session given by index or id"""
+        sessions = self.list_sessions()
+        if isinstance(session, int):
+            return sessions[session]
+        elif session in sessions:
+            return session
+        else:
+            raise ValueError("No such session %r" % session)
+
+    def save_metadata(self, session_id, **metadata):
+        """Store the collection parameters needed to read back a session
+
+        The given entries are added to the ones already stored.
+        """
+        filepath = os.path.join(self.data_folder, session_id,
+                                METADATA_FILENAME)
+        all_metadata = self.get_metadata(session_id)
+        all_metadata.update(metadata)
+        with open(filepath, 'w') as f:
+            json.dump(all_metadata, f)
+
+    def get_metadata(self, session=-1):
+        """Return the collection parameters of a session, if recorded"""
+        filepath = os.path.join(self.data_folder,
+                                self.get_session_id(session),
+                                METADATA_FILENAME)
+        if not os.path.exists(filepath):
+            return {}
+        with open(filepath) as f:
+            return json.load(f)
+
     def get_session(self, session=-1, signal='data'):
         """Return the aggregate data array of a session
 
@@ -244,16 +360,9 @@ class DataCollector(object):
 
         If the data is a single file, it is memmaped as an array.
         """
-        sessions = self.list_sessions()
-        if isinstance(session, int):
-            session_id = sessions[session]
-        elif session in sessions:
-            session_id = session
-        else:
-            raise ValueError("No such session %r" % session)
-
+        session_id = self.get_session_id(session)
         signal_folder = os.path.join(self.data_folder, session_id, signal)
-        data_files = os.listdir(signal_folder)
+        data_files = sorted(os.listdir(signal_folder))
         dtypes = [self.decode_dtype(filename) for filename in data_files]
         if len(data_files) == 0:
             return np.array([])
@@ -265,9 +374,137 @@ class DataCollector(object):
                                              dtype=dtype)
                                    for f, dtype in zip(data_files, dtypes)])
 
+    def get_timestamps(self, session=-1):
+        """Return the receive time in seconds of each sample of a session
+
+        Times are interpolated from the timestamps recorded every
+        timestamp_period samples of the session, after removal of the
+        transmission jitter: see dejitter_timestamps.
+        """
+        timestamps, period = self.get_session_timestamps(session)
+        n_samples = self.get_session(session, signal='quality').shape[0]
+        return interpolate_timestamps(timestamps, n_samples, period)
+
+    def record_gaps(self, session_id):
+        """Detect the gaps of a session and store them in its metadata"""
+        gaps = self.get_gaps(session_id, min_gap=MIN_GAP)
+        for index, duration in gaps:
+            logging.warn("Gap of %0.3fs before sample %d", duration, index)
+        self.save_metadata(session_id, gaps=[[int(index), float(duration)]
+                                             for index, duration in gaps])
+
+    def get_gaps(self, session=-1, min_gap=None):
+        """Return the (sample index, duration) of the gaps of a session
+
+        By default, the gaps recorded at the end of the collection are
+        returned if any, otherwise they are detected with MIN_GAP. Drops
+        shorter than min_gap, such as the few samples lost on a checksum
+        error and resync, are not reported: they are absorbed into the
+        timing of the neighbouring samples.
+        """
+        if min_gap is None:
+            gaps = self.get_metadata(session).get('gaps')
+            if gaps is not None:
+                return [tuple(gap) for gap in gaps]
+            min_gap = MIN_GAP
+        timestamps, period = self.get_session_timestamps(session)
+        return detect_gaps(timestamps, period, min_gap=min_gap)
+
+    def get_session_timestamps(self, session=-1):
+        """Return the recorded timestamps of a session and their period
+
+        The zero filled end of the last buffer, not written yet while the
+        session is being recorded or left untrimmed by a collection error,
+        is excluded.
+        """
+        session_id = self.get_session_id(session)
+        period = self.get_metadata(session_id).get('timestamp_period')
+        if period is None or not os.path.isdir(
+                os.path.join(self.data_folder, session_id, 'timestamps')):
+            raise ValueError("Session %r has no timestamps: it was recorded"
+                             " by an older version" % session_id)
+        timestamps = self.get_session(session_id, signal='timestamps')
+        unwritten = np.flatnonzero(timestamps <= 0)
+        if unwritten.shape[0] > 0:
+            timestamps = timestamps[:unwritten[0]]
+        return timestamps, period
+
+
+def dejitter_timestamps(timestamps, period=TIMESTAMP_PERIOD,
+                        sampling_frequency=SAMPLING_FREQUENCY,
+                        window=JITTER_WINDOW):
+    """Estimate the device emission times of the timestamped samples
+
+    Samples can arrive late (buffering, bluetooth stalls) but never before
+    they are emitted: the emission time of a sample is hence estimated as
+    its expected time at sampling_frequency plus the smallest lag observed
+    for this sample or the ones received in the next window seconds.
+
+    The window is bounded so that this lag floor follows the slow drift of
+    the device clock. It steps up where samples were dropped by the device
+    or the parser, and after stalls longer than the window.
+
+    Returns the dejittered timestamps and the lag floor.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.double)
+    expected = np.arange(timestamps.shape[0]) * (float(period)
+                                                 / sampling_frequency)
+    lag = timestamps - expected
+    floor = lag.copy()
+    n_window = int(window * sampling_frequency / period)
+    for shift in xrange(1, min(n_window, lag.shape[0])):
+        np.minimum(floor[:-shift], lag[shift:], out=floor[:-shift])
+    return expected + floor, floor
+
+
+def interpolate_timestamps(timestamps, n_samples, period=TIMESTAMP_PERIOD,
+                           sampling_frequency=SAMPLING_FREQUENCY):
+    """Time of each of the n_samples from the timestamps of every period
+
+    The samples following a timestamp are spaced at sampling_frequency, or
+    closer if the next timestamp comes earlier, so that the times never
+    decrease and a gap stays located right before the next timestamp.
+    """
+    if timestamps.shape[0] == 0:
+        return np.zeros(n_samples)
+    times, _ = dejitter_timestamps(timestamps, period, sampling_frequency)
+    spacing = np.empty(times.shape[0])
+    spacing[:-1] = np.clip(np.diff(times) / period, 0,
+                           1.0 / sampling_frequency)
+    spacing[-1] = 1.0 / sampling_frequency
+    indices = np.arange(n_samples)
+    blocks = np.minimum(indices // period, times.shape[0] - 1)
+    return times[blocks] + (indices - blocks * period) * spacing[blocks]
+
+
+def detect_gaps(timestamps, period=TIMESTAMP_PERIOD,
+                sampling_frequency=SAMPLING_FREQUENCY, min_gap=MIN_GAP):
+    """Find where samples were dropped from the recorded timestamps
+
+    Gaps are the local jumps of the lag floor of dejitter_timestamps. Drops
+    shorter than min_gap are absorbed into the dejittered timing instead:
+    the transmission jitter makes them undetectable.
+    Returns a list of (sample index, duration in seconds) tuples where the
+    sample index is the first timestamped sample after the gap. The
+    resolution of the location of a gap is period samples.
+    """
+    if len(timestamps) < 2:
+        return []
+    _, floor = dejitter_timestamps(timestamps, period, sampling_frequency)
+    steps = np.diff(floor)
+    return [((i + 1) * period, steps[i])
+            for i in np.flatnonzero(steps >= min_gap)]
+
 
 def main():
+    # GUI dependencies are only needed by the interactive collection
+    import gtk
+    import gobject
+    import matplotlib
+    matplotlib.use('GTKAgg')
+    import matplotlib.pyplot as plt
     from .monitor import MatplotlibMonitor
+
     logging.basicConfig(level=logging.INFO)
     device = '/dev/rfcomm0'
     if len(sys.argv) > 1:
@@ -0,0 +1,289 @@
+"""Virtual ThinkGear device on a pseudo-terminal for tests and benchmarks
+
+The emulator writes a valid ThinkGear byte stream on the master side of a
+pty so that ThinkGearProtocol can open the slave side just like the
+/dev/rfcomm0 serial binding of a real headset:
+
+>>> with ThinkGearEmulator(speed=10) as emulator:
+...     for pkt in ThinkGearProtocol(emulator.device).get_packets():
+...         print pkt
+
+"""
+
+import os
+import sys
+import tty
+import time
+import select
+import struct
+import logging
+import tempfile
+import shutil
+import threading
+
+import numpy as np
+
+from .collect import DataCollector
+from .collect import SAMPLING_FREQUENCY
+
+
+def checksum(payload):
+    return ~sum(ord(c) for c in payload) & 0xff
+
+
+def encode_packet(payload):
+    """Frame a payload with the sync bytes, its length and checksum"""
+    return '\xAA\xAA' + chr(len(payload)) + payload + chr(checksum(payload))
+
+
+def encode_raw_wave(value):
+    return '\x80\x02' + struct.pack('>h', value)
+
+
+def encode_poor_signal(value):
+    return '\x02' + chr(value)
+
+
+def encode_attention(value):
+    return '\x04' + chr(value)
+
+
+def encode_meditation(value):
+    return '\x05' + chr(value)
+
+
+def encode_eeg_power(values):
+    """Encode 8 band powers as 3 bytes big-endian unsigned integers"""
+    return '\x83\x18' + ''.join(struct.pack('>L', v)[1:] for v in values)
+
+
+def counter_signal(n):
+    """Raw wave value encoding the sample index modulo 2 ** 16"""
+    return n % 65536 - 32768
+
+
+def counter_index(value, previous):
+    """Recover the absolute index of a counter_signal sample
+
+    Assumes that less than 2 ** 16 samples were lost since the sample of
+    index previous.
+    """
+    return previous + (int(value) + 32768 - previous) % 65536
+
+
+def sine_signal(n, frequency=10.0, amplitude=500):
+    return int(amplitude * np.sin(2 * np.pi * frequency * n
+                                  / SAMPLING_FREQUENCY))
+
+
+class ThinkGearEmulator(object):
+    """Emit a ThinkGear stream on a pty from a background thread
+
+    Raw wave samples are sent at sampling_frequency * speed Hz, or as fast
+    as the reader consumes them if speed is None. Once per second of device
+    time a packet with the poor signal, attention, meditation and EEG power
+    values is sent as well, as the MindSet does.
+
+    corruption is the probability for a packet to have one of its payload
+    bytes flipped (hence a bad checksum) and sync_loss the probability for
+    a packet to be truncated, forcing the parser to resynchronize.
+
+    The time at which each block of block_size samples has been completely
+    written on the pty, hence is readable, is recorded in emission_times.
+    """
+
+    def __init__(self, speed=1.0, sampling_frequency=SAMPLING_FREQUENCY,
+                 signal=sine_signal, poor_signal=0, corruption=0.0,
+                 sync_loss=0.0, block_size=16, seed=0):
+        self.speed = speed
+        self.sampling_frequency = sampling_frequency
+        self.signal = signal
+        self.poor_signal = poor_signal
+        self.corruption = corruption
+        self.sync_loss = sync_loss
+        self.block_size = block_size
+        self.rng = np.random.RandomState(seed)
+        self.emitted = 0
+        self.emission_times = []
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.master_fd, self.slave_fd = os.openpty()
+        # no echo nor newline translation of the binary stream
+        tty.setraw(self.slave_fd)
+        self.device = os.ttyname(self.slave_fd)
+
+    def make_extra_packet(self):
+        payload = (encode_poor_signal(self.poor_signal)
+                   + encode_attention(self.rng.randint(101))
+                   + encode_meditation(self.rng.randint(101))
+                   + encode_eeg_power(self.rng.randint(2 ** 24, size=8)))
+        return encode_packet(payload)
+
+    def alter(self, packet):
+        """Randomly corrupt or truncate a packet"""
+        if self.corruption and self.rng.uniform() < self.corruption:
+            i = self.rng.randint(3, len(packet) - 1)
+            packet = packet[:i] + chr(ord(packet[i]) ^ 0xff) + packet[i + 1:]
+        if self.sync_loss and self.rng.uniform() < self.sync_loss:
+            packet = packet[:self.rng.randint(1, len(packet))]
+        return packet
+
+    def make_block(self):
+        packets = []
+        for n in xrange(self.emitted, self.emitted + self.block_size):
+            if n % self.sampling_frequency == 0:
+                packets.append(self.alter(self.make_extra_packet()))
+            packets.append(self.alter(
+                encode_packet(encode_raw_wave(self.signal(n)))))
+        return ''.join(packets)
+
+    def write(self, data):
+        """Write all of data unless stopped, return False if stopped"""
+        while data:
+            _, writable, _ = select.select([], [self.master_fd], [], 0.1)
+            if self._stop.is_set():
+                return False
+            if writable:
+                data = data[os.write(self.master_fd, data):]
+        return True
+
+    def run(self):
+        start = time.time()
+        try:
+            while not self._stop.is_set():
+                if self.speed is not None:
+                    deadline = start + float(self.emitted) / (
+                        self.sampling_frequency * self.speed)
+                    delay = deadline - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                if not self.write(self.make_block()):
+                    break
+                self.emission_times.append(time.time())
+                self.emitted += self.block_size
+        except OSError, e:
+            logging.info("Emulator stopped: %s", e)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        os.close(self.master_fd)
+        os.close(self.slave_fd)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def get_emission_time(self, n, timeout=1.0):
+        """Time at which the sample of index n was written on the pty
+
+        The reader can consume a block before the emulator thread records its
+        emission time: wait for it up to timeout seconds.
+        """
+        block = n // self.block_size
+        deadline = time.time() + timeout
+        while len(self.emission_times) <= block:
+            if time.time() > deadline:
+                raise ValueError("Sample %d was never emitted" % n)
+            time.sleep(0.0001)
+        return self.emission_times[block]
+
+
+class LatencyMonitor(object):
+    """DataCollector monitor recording when counter samples hit the memmap
+
+    Must be used with an emulator emitting counter_signal samples.
+    """
+
+    def __init__(self, emulator, period=128):
+        self.emulator = emulator
+        self.period = period
+        self.index = -1
+        self.latencies = []
+
+    def init(self, collector):
+        self.collector = collector
+
+    def update(self, data_slice):
+        # the data has been flushed to the memmap just before this call
+        now = time.time()
+        # only decode the last sample not to slow down the measured pipeline:
+        # counter_index tolerates the samples dropped in between
+        self.index = counter_index(data_slice[-1], self.index + self.period)
+        # clip the tiny negative values of the samples consumed before their
+        # block emission time was recorded
+        self.latencies.append(max(0.0, now - self.emulator.get_emission_time(
+            self.index)))
+
+
+def benchmark(n_samples=SAMPLING_FREQUENCY * 10, speed=1.0, period=128,
+              data_folder=None, **emulator_params):
+    """Measure the throughput and latency of the collection pipeline
+
+    Samples go from the emulator through the pty, ThinkGearProtocol and
+    DataCollector.collect to the memmaped buffers. Latencies are measured
+    every period samples, for the last sample of the period, in seconds.
+
+    With speed=None the emulator writes as fast as the pipeline reads: the
+    samples then mostly wait in the pty queue and only the throughput is
+    reported.
+    """
+    tmp_folder = None
+    if data_folder is None:
+        data_folder = tmp_folder = tempfile.mkdtemp(prefix='pythinkgear_')
+    try:
+        emulator = ThinkGearEmulator(speed=speed, signal=counter_signal,
+                                     **emulator_params)
+        monitor = LatencyMonitor(emulator, period=period)
+        collector = DataCollector(emulator.device, data_folder,
+                                  monitor=monitor)
+        with emulator:
+            start = time.time()
+            session_id = collector.collect(n_samples)
+            duration = time.time() - start
+        collected = collector.get_session(session_id).shape[0]
+    finally:
+        if tmp_folder is not None:
+            shutil.rmtree(tmp_folder)
+
+    results = {
+        'samples': collected,
+        'duration': duration,
+        'samples_per_second': collected / duration,
+    }
+    if speed is not None:
+        latencies = np.array(monitor.latencies)
+        results['latency_median'] = np.median(latencies)
+        results['latency_p95'] = np.percentile(latencies, 95)
+        results['latency_max'] = latencies.max()
+    return results
+
+
+def main():
+    logging.basicConfig(level=logging.WARN)
+    speed = 1.0
+    if len(sys.argv) > 1:
+        speed = None if sys.argv[1] == 'max' else float(sys.argv[1])
+
+    results = benchmark(speed=speed)
+    print("collected %d samples in %0.3fs" % (results['samples'],
+                                              results['duration']))
+    print("throughput: %0.1f samples/s" % results['samples_per_second'])
+    if speed is None:
+        return
+    print("latency median: %0.2fms, p95: %0.2fms, max: %0.2fms" % (
+        results['latency_median'] * 1000, results['latency_p95'] * 1000,
+        results['latency_max'] * 1000))
+
+if __name__ == '__main__':
+    main()
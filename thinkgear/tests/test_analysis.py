@@ -0,0 +1,75 @@
+import os
+import numpy as np
+from numpy.testing import assert_array_equal
+from nose.tools import with_setup
+from nose.tools import assert_equal
+
+from ..analysis import BANDS
+from ..analysis import band_powers
+from ..analysis import batch_band_powers
+from ..collect import DataCollector
+from ..collect import SAMPLING_FREQUENCY
+from .test_collect import MockData
+from . import test_collect
+from .test_collect import setup_data_folder
+from .test_collect import teardown_data_folder
+
+
+class SineProtocol(object):
+    """Generate packets of a 10Hz sine wave (high alpha)"""
+
+    def __init__(self, device):
+        self.t = 0
+
+    def get_packets(self):
+        while True:
+            yield [MockData(100 * np.sin(2 * np.pi * 10.0 * self.t
+                                         / SAMPLING_FREQUENCY))]
+            self.t += 1
+
+
+def test_band_powers():
+    t = np.arange(SAMPLING_FREQUENCY * 4) / float(SAMPLING_FREQUENCY)
+    data = 1000 + 100 * np.sin(2 * np.pi * 5.0 * t)
+    quality = np.ones(data.shape, dtype=bool)
+    quality[SAMPLING_FREQUENCY + 3] = False
+
+    powers, good = band_powers(data, quality)
+    assert_equal(powers.shape, (4, len(BANDS)))
+    assert np.all(powers.argmax(axis=1) == BANDS._fields.index('theta'))
+    assert_array_equal(good, [True, False, True, True])
+
+    # overlapping windows
+    powers, good = band_powers(data, quality, step=SAMPLING_FREQUENCY // 2)
+    assert_equal(powers.shape, (7, len(BANDS)))
+    assert_array_equal(good, [True, False, False, True, True, True, True])
+
+    # not enough data for a single window
+    powers, good = band_powers(data[:10])
+    assert_equal(powers.shape, (0, len(BANDS)))
+    assert_equal(good.shape, (0,))
+
+
+@with_setup(setup_data_folder, teardown_data_folder)
+def test_batch_band_powers():
+    data_folder = test_collect.data_folder
+    collector = DataCollector('/fake/device', data_folder,
+                              chunk_size=SAMPLING_FREQUENCY,
+                              protocol=SineProtocol, packet_type=MockData)
+    collector.collect(n_samples=SAMPLING_FREQUENCY * 3)
+    collector.collect(n_samples=SAMPLING_FREQUENCY * 2 + 10)
+    sessions = collector.list_sessions()
+
+    # a stray file is listed as a session but cannot be processed
+    open(os.path.join(data_folder, 'notes.txt'), 'w').close()
+
+    for n_jobs in (1, 2):
+        results, errors = batch_band_powers(data_folder, n_jobs=n_jobs)
+        assert_equal(sorted(results.keys()), sessions)
+        assert_equal(errors.keys(), ['notes.txt'])
+        for session_id, n_windows in zip(sessions, (3, 2)):
+            powers, good = results[session_id]
+            assert_equal(powers.shape, (n_windows, len(BANDS)))
+            assert np.all(good)
+            assert np.all(powers.argmax(axis=1)
+                          == BANDS._fields.index('highalpha'))
@@ -0,0 +1,151 @@
+import os
+import time
+import numpy as np
+from nose.tools import with_setup
+from nose.tools import assert_equal
+from nose.tools import assert_raises
+
+from ..analysis import session_summary
+from ..cache import SessionCache
+from ..cache import TMP_FILE_AGE
+from ..collect import DataCollector
+from .test_collect import MockData
+from .test_collect import RandomProtocol
+from . import test_collect
+from .test_collect import teardown_data_folder
+
+
+calls = []
+
+
+def count_samples(data_folder, session_id, signal='data', padding=0):
+    calls.append((session_id, signal, padding))
+    collector = DataCollector(None, data_folder)
+    return np.zeros(collector.get_session(session_id, signal).shape[0]
+                    + padding)
+
+
+def setup_data_folder():
+    test_collect.setup_data_folder()
+    del calls[:]
+
+
+def cache_entries(cache):
+    return sorted(f for f in os.listdir(cache.cache_folder)
+                  if f.endswith('.pickle'))
+
+
+@with_setup(setup_data_folder, teardown_data_folder)
+def test_session_cache():
+    data_folder = test_collect.data_folder
+    collector = DataCollector('/fake/device', data_folder,
+                              protocol=RandomProtocol, packet_type=MockData)
+    session_id = collector.collect(n_samples=42)
+    cache = SessionCache(data_folder)
+
+    # the cache folder is not listed as a session
+    assert_equal(collector.list_sessions(), [session_id])
+
+    assert_equal(cache.call(count_samples, session_id).shape, (42,))
+    assert_equal(cache.call(count_samples, session_id).shape, (42,))
+    assert_equal(len(calls), 1)
+
+    # parameters are part of the key
+    cache.call(count_samples, session_id, signal='quality')
+    cache.call(count_samples, session_id, signal='quality')
+    assert_equal(len(calls), 2)
+    assert_equal(len(cache_entries(cache)), 2)
+
+    # updating a chunk of the session invalidates the cached results
+    data_folder_session = os.path.join(data_folder, session_id, 'data')
+    chunk = os.path.join(data_folder_session,
+                         os.listdir(data_folder_session)[0])
+    mtime = os.stat(chunk).st_mtime
+    os.utime(chunk, (mtime + 10, mtime + 10))
+    cache.call(count_samples, session_id)
+    assert_equal(len(calls), 3)
+
+    # stale entries are discarded
+    assert_equal(len(cache_entries(cache)), 1)
+
+    summary = cache.call(session_summary, session_id)
+    assert_equal(summary['n_samples'], 42)
+    assert_equal(summary['quality_ratio'], 1.0)
+    assert_equal(cache.call(session_summary, session_id), summary)
+
+
+@with_setup(setup_data_folder, teardown_data_folder)
+def test_session_cache_eviction():
+    data_folder = test_collect.data_folder
+    collector = DataCollector('/fake/device', data_folder,
+                              protocol=RandomProtocol, packet_type=MockData)
+    session_id = collector.collect(n_samples=10)
+    cache = SessionCache(data_folder, max_size=3 * 10000)
+
+    # each entry is a bit more than 8000 bytes large: only 3 fit
+    now = time.time()
+    for i, padding in enumerate(range(1000, 1004)):
+        cache.call(count_samples, session_id, padding=padding)
+        # make the last use time of each entry distinguishable
+        filepath = os.path.join(cache.cache_folder, cache.get_key(
+            count_samples, session_id, {'padding': padding}))
+        os.utime(filepath, (now - 100 + i, now - 100 + i))
+    assert_equal(len(cache_entries(cache)), 3)
+
+    # the least recently used entry was evicted
+    del calls[:]
+    cache.call(count_samples, session_id, padding=1000)
+    assert_equal(len(calls), 1)
+    cache.call(count_samples, session_id, padding=1003)
+    assert_equal(len(calls), 1)
+
+
+def sum_weights(data_folder, session_id, weights=None):
+    calls.append(session_id)
+    return weights.sum()
+
+
+def unpicklable(data_folder, session_id):
+    return lambda: None
+
+
+@with_setup(setup_data_folder, teardown_data_folder)
+def test_session_cache_array_params():
+    data_folder = test_collect.data_folder
+    collector = DataCollector('/fake/device', data_folder,
+                              protocol=RandomProtocol, packet_type=MockData)
+    session_id = collector.collect(n_samples=10)
+    cache = SessionCache(data_folder)
+
+    # large arrays have a truncated repr but are hashed by content
+    weights = np.zeros(2000)
+    other_weights = weights.copy()
+    other_weights[1000] = 1
+    assert_equal(cache.call(sum_weights, session_id, weights=weights), 0)
+    assert_equal(cache.call(sum_weights, session_id, weights=other_weights),
+                 1)
+    assert_equal(cache.call(sum_weights, session_id, weights=weights.copy()),
+                 0)
+    assert_equal(len(calls), 2)
+
+
+@with_setup(setup_data_folder, teardown_data_folder)
+def test_session_cache_tmp_files():
+    data_folder = test_collect.data_folder
+    collector = DataCollector('/fake/device', data_folder,
+                              protocol=RandomProtocol, packet_type=MockData)
+    session_id = collector.collect(n_samples=10)
+    cache = SessionCache(data_folder)
+
+    # a failed write does not leave its temporary file behind
+    assert_raises(Exception, cache.call, unpicklable, session_id)
+    assert_equal(os.listdir(cache.cache_folder), [])
+
+    # temporary files of interrupted writes are eventually removed
+    old = os.path.join(cache.cache_folder, 'interrupted.tmp')
+    recent = os.path.join(cache.cache_folder, 'in_progress.tmp')
+    for filepath in (old, recent):
+        open(filepath, 'wb').close()
+    os.utime(old, (time.time() - 2 * TMP_FILE_AGE,) * 2)
+    cache.evict()
+    assert_equal(os.listdir(cache.cache_folder), ['in_progress.tmp'])
@@ -1,12 +1,20 @@
 import os
+import sys
+import time
 import tempfile
 import shutil
 import numpy as np
 from numpy.testing import assert_array_equal
+from nose.plugins.skip import SkipTest
 from nose.tools import with_setup
 from nose.tools import assert_equal
+from nose.tools import assert_raises
 
 from ..collect import DataCollector
+from ..collect import SAMPLING_FREQUENCY
+from ..collect import detect_gaps
+from ..collect import dejitter_timestamps
+from ..collect import posix_monotonic_clock
 from ..thinkgear import ThinkGearRawWaveData
 
 
@@ -32,7 +40,7 @@ class RandomProtocol(object):
 
 def setup_data_folder():
     global data_folder
-    data_folder = tempfile.mkdtemp(prefix='pythingear_')
+    data_folder = tempfile.mkdtemp(prefix='pythinkgear_')
 
 
 def teardown_data_folder():
@@ -90,3 +98,144 @@ def test_session_management():
     quality_session_0 = collector.get_session(0, signal='quality')
     assert_equal(quality_session_0.shape, data_session_0.shape)
     assert np.all(quality_session_0)
+
+
+@with_setup(setup_data_folder, teardown_data_folder)
+def test_timestamps():
+    collector = DataCollector('/fake/device', data_folder, chunk_size=1000,
+                              protocol=RandomProtocol, packet_type=MockData,
+                              timestamp_period=32)
+    collector.collect(n_samples=2500)
+
+    # one timestamp every 32 samples, rotated with its own chunks
+    timestamps = collector.get_session(signal='timestamps')
+    assert_equal(timestamps.shape, (2500 // 32 + 1,))
+    assert np.all(np.diff(timestamps) >= 0)
+
+    # samples are never emitted after they are received, even if the mock
+    # protocol is much faster than the device
+    times = collector.get_timestamps()
+    assert_equal(times.shape, (2500,))
+    assert np.all(np.diff(times) >= 0)
+    assert np.all(times[::32] <= timestamps)
+    assert_equal(collector.get_gaps(), [])
+
+
+def test_detect_gaps():
+    rng = np.random.RandomState(0)
+    expected = np.arange(100) * 32.0 / SAMPLING_FREQUENCY
+    lag = rng.uniform(0, 0.03, size=100)
+    lag[60:] += 0.5
+    timestamps = 1000.0 + expected + lag
+
+    # the jitter is not reported as gaps, only the dropped samples
+    gaps = detect_gaps(timestamps, period=32)
+    assert_equal(len(gaps), 1)
+    assert_equal(gaps[0][0], 60 * 32)
+    assert abs(gaps[0][1] - 0.5) < 0.03
+
+    assert_equal(detect_gaps(timestamps[:60], period=32), [])
+
+
+def test_detect_gaps_drift():
+    # 10 minutes on a device whose clock runs 0.2% fast with 0.5s of samples
+    # dropped after 60 timestamps and a 1.8s bluetooth stall later on
+    rng = np.random.RandomState(0)
+    blocks = np.arange(SAMPLING_FREQUENCY * 600 // 32)
+    emitted = 1000.0 + blocks * 32.0 / (SAMPLING_FREQUENCY * 1.002)
+    emitted[60:] += 0.5
+    timestamps = emitted + rng.uniform(0, 0.03, size=blocks.shape[0])
+    timestamps[3000:3030] = timestamps[3030]
+
+    gaps = detect_gaps(timestamps, period=32)
+    assert_equal(len(gaps), 1)
+    assert_equal(gaps[0][0], 60 * 32)
+    assert abs(gaps[0][1] - 0.5) < 0.03
+
+    # the emission times are recovered despite the drift and the stall
+    times, _ = dejitter_timestamps(timestamps, period=32)
+    assert np.all(np.abs(times - emitted) < 0.02)
+
+
+def test_posix_monotonic_clock():
+    clock = posix_monotonic_clock()
+    if clock is None:
+        raise SkipTest("no clock_gettime on %s" % sys.platform)
+    times = [clock() for _ in range(1000)]
+    assert np.all(np.diff(times) >= 0)
+
+
+@with_setup(setup_data_folder, teardown_data_folder)
+def test_timestamps_metadata():
+    collector = DataCollector('/fake/device', data_folder,
+                              protocol=RandomProtocol, packet_type=MockData,
+                              timestamp_period=16)
+    session_id = collector.collect(n_samples=100)
+
+    # the period the session was recorded with is used to read it back
+    reader = DataCollector(None, data_folder)
+    assert_equal(reader.get_metadata(session_id),
+                 {'timestamp_period': 16, 'gaps': []})
+    assert_equal(reader.get_session(session_id, 'timestamps').shape, (7,))
+    assert_equal(reader.get_timestamps(session_id).shape, (100,))
+
+    # sessions recorded before the timestamps were introduced
+    shutil.rmtree(os.path.join(data_folder, session_id, 'timestamps'))
+    os.unlink(os.path.join(data_folder, session_id, 'metadata.json'))
+    assert_equal(reader.get_metadata(session_id), {})
+    assert_raises(ValueError, reader.get_timestamps, session_id)
+    assert_raises(ValueError, reader.get_gaps, session_id)
+
+
+class FailingProtocol(RandomProtocol):
+    """Generate 100 samples then fail as a disconnected serial device"""
+
+    def get_packets(self):
+        for _ in range(100):
+            yield [MockData(self.rng.normal())]
+        raise IOError("device disconnected")
+
+
+@with_setup(setup_data_folder, teardown_data_folder)
+def test_untrimmed_timestamps():
+    collector = DataCollector('/fake/device', data_folder, chunk_size=1000,
+                              protocol=FailingProtocol, packet_type=MockData)
+    start = time.time()
+    assert_raises(IOError, collector.collect)
+
+    # the session is left untrimmed, as seen by a reader during collection:
+    # the unwritten zero timestamps are ignored
+    assert_equal(collector.get_session(signal='timestamps').shape, (31,))
+    timestamps, period = collector.get_session_timestamps()
+    assert_equal(timestamps.shape, (4,))
+    times = collector.get_timestamps()
+    assert_equal(times.shape, (1000,))
+    assert np.all(times[:100] > start - 1.0)
+    assert_equal(collector.get_gaps(), [])
+
+
+@with_setup(setup_data_folder, teardown_data_folder)
+def test_record_gaps():
+    collector = DataCollector('/fake/device', data_folder,
+                              protocol=RandomProtocol, packet_type=MockData)
+    session_id = collector.collect(n_samples=100 * 32)
+    assert_equal(collector.get_metadata(session_id)['gaps'], [])
+
+    # replace the recorded timestamps by ones with a 0.5s drop
+    timestamps = collector.get_session(session_id, signal='timestamps')
+    assert_equal(timestamps.shape, (100,))
+    simulated = 1000.0 + np.arange(100) * 32.0 / SAMPLING_FREQUENCY
+    simulated[60:] += 0.5
+    timestamps[:] = simulated
+    timestamps.flush()
+    del timestamps
+
+    collector.record_gaps(session_id)
+    gaps = collector.get_gaps(session_id)
+    assert_equal(len(gaps), 1)
+    assert_equal(gaps[0][0], 60 * 32)
+    assert abs(gaps[0][1] - 0.5) < 1e-6
+    assert_equal(collector.get_metadata(session_id)['timestamp_period'], 32)
+
+    # other thresholds are detected again from the timestamps
+    assert_equal(collector.get_gaps(session_id, min_gap=1.0), [])
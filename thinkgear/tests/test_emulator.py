@@ -0,0 +1,70 @@
+import numpy as np
+from numpy.testing import assert_array_equal
+from nose.tools import with_setup
+from nose.tools import assert_equal
+
+from ..collect import DataCollector
+from ..collect import SAMPLING_FREQUENCY
+from ..emulator import ThinkGearEmulator
+from ..emulator import benchmark
+from ..emulator import counter_signal
+from ..emulator import counter_index
+from ..thinkgear import ThinkGearProtocol
+from ..thinkgear import ThinkGearRawWaveData
+from ..thinkgear import ThinkGearEEGPowerData
+from ..thinkgear import ThinkGearAttentionData
+from ..thinkgear import ThinkGearPoorSignalData
+from . import test_collect
+from .test_collect import setup_data_folder
+from .test_collect import teardown_data_folder
+
+
+def test_counter_signal():
+    for n in (0, 1, 42, 65535, 65536, 100000):
+        assert_equal(counter_index(counter_signal(n), n - 10), n)
+        assert_equal(counter_index(counter_signal(n), n), n)
+
+
+def test_emulator_protocol():
+    with ThinkGearEmulator(speed=None, signal=counter_signal) as emulator:
+        packets = ThinkGearProtocol(emulator.device).get_packets()
+        data = [d for _ in range(SAMPLING_FREQUENCY + 2)
+                for d in packets.next()]
+
+    raw = [d.value for d in data if isinstance(d, ThinkGearRawWaveData)]
+    assert_equal(raw, [counter_signal(n) for n in range(len(raw))])
+    for data_type in (ThinkGearEEGPowerData, ThinkGearAttentionData,
+                      ThinkGearPoorSignalData):
+        assert_equal(len([d for d in data if isinstance(d, data_type)]), 2)
+
+
+@with_setup(setup_data_folder, teardown_data_folder)
+def test_emulator_collect():
+    data_folder = test_collect.data_folder
+    with ThinkGearEmulator(speed=None, signal=counter_signal) as emulator:
+        collector = DataCollector(emulator.device, data_folder,
+                                  chunk_size=1000)
+        collector.collect(n_samples=2500)
+    expected = [counter_signal(n) for n in range(2500)]
+    assert_array_equal(collector.get_session(), expected)
+
+
+@with_setup(setup_data_folder, teardown_data_folder)
+def test_emulator_corruption():
+    data_folder = test_collect.data_folder
+    with ThinkGearEmulator(speed=None, signal=counter_signal,
+                           corruption=0.05, sync_loss=0.05) as emulator:
+        collector = DataCollector(emulator.device, data_folder)
+        collector.collect(n_samples=2000)
+
+    # corrupted samples are dropped but the others are still in order, up to
+    # the rare garbage packets that match their checksum after a sync loss
+    indices = [counter_index(v, 0) for v in collector.get_session()]
+    assert np.mean(np.diff(indices) >= 1) > 0.99
+
+
+def test_benchmark():
+    results = benchmark(n_samples=SAMPLING_FREQUENCY, speed=4.0)
+    assert_equal(results['samples'], SAMPLING_FREQUENCY)
+    assert results['samples_per_second'] > 0
+    assert 0 < results['latency_median'] <= results['latency_max']